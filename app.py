@@ -1,6 +1,12 @@
 import streamlit as st
-import pdfplumber
+import hashlib
+import json
+import re
+import shelve
+import threading
+import pypdfium2 as pdfium
 import google.generativeai as genai
+import numpy as np
 import textwrap
 
 # --- Page Configuration ---
@@ -10,19 +16,122 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- Model Configuration ---
+MODEL_NAME = "gemini-1.5-flash"
+
+# --- On-Disk Analysis Cache (survives server restarts) ---
+ANALYSIS_CACHE_PATH = ".analysis_cache.db"
+ANALYSIS_CACHE_VERSION = 3  # Bump when the stored (summary, risks, dashboard, embeddings) format changes
+
+# --- Custom Styles ---
+CUSTOM_CSS = """
+    <style>
+        .main { background-color: #F0F2F6; }
+        .st-emotion-cache-1c7y2kd { background-color: #E1F5FE; } /* User chat message */
+        .st-emotion-cache-4oy321 { background-color: #FFFFFF; } /* Assistant chat message */
+        .st-emotion-cache-1c7y2kd p, .st-emotion-cache-4oy321 p { color: #262730; } /* Chat text color */
+        .st-emotion-cache-1v0mbdj > button:first-child { font-weight: 600; } /* Style primary button */
+    </style>
+"""
+
+# --- Prompt Templates (dedented once at import) ---
+# Single-call analysis: the document is sent once and the answer is constrained to ANALYSIS_SCHEMA
+ANALYSIS_TEMPLATE = textwrap.dedent("""
+    Analyze this document and fill in every field of the JSON response:
+    - summary: Summarize the document's purpose, parties, and key obligations in plain English (markdown).
+    - risks: Analyze the document for risks and key clauses (markdown). Categorize them using these exact markdown headers and emojis:
+      - **⚠️ High-Priority Risks:** (e.g., penalties, liabilities, auto-renewals)
+      - **📝 Key Responsibilities:** (e.g., payment duties, notice periods, confidentiality)
+      - **✅ Standard Provisions:** (e.g., governing law, severability)
+    - parties, key_dates, financial_amounts: The key entities of the document.
+    - action_items: A checklist of recommended next steps for the user.
+    Document:
+    ---
+    {doc}
+""")
+
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "risks": {"type": "STRING"},
+        "parties": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "key_dates": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"date": {"type": "STRING"}, "description": {"type": "STRING"}},
+                "required": ["date", "description"],
+            },
+        },
+        "financial_amounts": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"amount": {"type": "STRING"}, "description": {"type": "STRING"}},
+                "required": ["amount", "description"],
+            },
+        },
+        "action_items": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["summary", "risks", "parties", "key_dates", "financial_amounts", "action_items"],
+}
+
+QA_MESSAGE_TEMPLATE = '**Document Excerpts:**\n---\n{excerpts}\n---\n**User\'s Question:** "{question}"\n**Answer:**'
+
+CHAT_SUMMARY_TEMPLATE = textwrap.dedent("""
+    Summarize this conversation about a legal document in a few sentences.
+    Keep every fact, figure, and quote the user may refer back to.
+    Conversation:
+    ---
+    {transcript}
+""")
+
+# --- Canned Chat Replies (answered locally, without calling Gemini) ---
+GREETING_RE = re.compile(r"^\s*(hi|hello|hey|yo|good (morning|afternoon|evening))[\s!.?]*$", re.I)
+# Anchored to the whole message so factual questions that merely contain these words still reach Gemini.
+# Matches:      "Is this safe?", "is this contract fair to sign", "Should I sign it?", "Can you give me legal advice?"
+# Doesn't match: "Is it ok to sublet the apartment under clause 7?", "Is this good faith obligation mutual?",
+#               "What does section 4 say about legal advice fees?"
+OPINION_RE = re.compile(
+    r"^\s*(is (it|this|this (contract|agreement|document|lease|deal)) (safe|fair|good|ok|okay)( to sign| for me)?"
+    r"|should i sign( (it|this|this (contract|agreement|document|lease)))?"
+    r"|(can|could) you give me legal advice)[\s!.?]*$",
+    re.I,
+)
+GREETING_REPLY = "Hello! 👋 Ask me anything about your document, such as payment terms, deadlines, or termination clauses."
+OPINION_REPLY = (
+    "I can't give legal advice or judge whether this document is safe or fair. "
+    "Please review the **📊 Risk & Clause Breakdown** above for the clauses that deserve attention, "
+    "and consult a qualified lawyer before signing."
+)
+
+# --- Chat Instructions (sent once per chat session) ---
+QA_INSTRUCTIONS = textwrap.dedent("""
+    **Role:** AI Assistant answering questions about a legal document.
+    **Instructions Hierarchy:**
+    1. **Handle Greetings:** If the user says "hi" or "hello", give a friendly greeting.
+    2. **Handle Opinions:** If the user asks if the doc is "safe" or "fair", state you cannot give legal advice and direct them to the risk analysis.
+    3. **Handle Factual Questions:** Answer questions using *only* the document excerpts provided with each question. Cite your source with a quote. If the answer isn't in the excerpts, say so.
+    The latest message will contain the relevant document excerpts followed by the user's question.
+""")
+
+# --- Document Size Limits ---
+CHUNK_SIZE_CHARS = 4000          # ~1000 tokens per retrieval chunk
+ANALYSIS_MAX_CHARS = 200_000     # Prefix of the document sent for the analysis
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_BATCH_SIZE = 100       # Max contents per batch embedding request
+TOP_K_CHUNKS = 5                 # Chunks injected into each chat prompt
+MAX_DOC_CHARS = 800_000          # Extraction stops once this much text is collected
+CHAT_MAX_TURNS = 10              # Turns kept verbatim before older ones are summarized
+CHAT_KEEP_TURNS = 5              # Most recent turns kept verbatim after summarizing
+
 # --- Helper Functions ---
 
 def inject_custom_css():
     """Injects custom CSS for a professional UI."""
-    st.markdown("""
-        <style>
-            .main { background-color: #F0F2F6; }
-            .st-emotion-cache-1c7y2kd { background-color: #E1F5FE; } /* User chat message */
-            .st-emotion-cache-4oy321 { background-color: #FFFFFF; } /* Assistant chat message */
-            .st-emotion-cache-1c7y2kd p, .st-emotion-cache-4oy321 p { color: #262730; } /* Chat text color */
-            .st-emotion-cache-1v0mbdj > button:first-child { font-weight: 600; } /* Style primary button */
-        </style>
-    """, unsafe_allow_html=True)
+    # Must run on every rerun: Streamlit drops any element the script doesn't re-emit
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 @st.cache_resource
 def initialize_model():
@@ -30,7 +139,7 @@ def initialize_model():
     try:
         api_key = st.secrets["GEMINI_API_KEY"]
         genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-1.5-flash')
+        return genai.GenerativeModel(MODEL_NAME)
     except KeyError:
         st.error("Gemini API key not found. Please add it to your Streamlit secrets (`.streamlit/secrets.toml`).")
         st.stop()
@@ -38,23 +147,270 @@ def initialize_model():
         st.error(f"Error initializing AI model. Please check your API key. Details: {e}")
         st.stop()
 
-def extract_text_from_pdf(uploaded_file):
-    """Extracts text from an uploaded PDF file."""
-    if not uploaded_file: return None
+@st.cache_resource
+def _pdfium_lock():
+    """Returns the process-wide lock serializing PDFium calls (the library is not thread-safe)."""
+    return threading.Lock()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def extract_text_from_pdf(file_bytes, max_chars=MAX_DOC_CHARS):
+    """Extracts up to max_chars of text from the bytes of an uploaded PDF file (cached per file content)."""
+    if not file_bytes: return None
     try:
-        with pdfplumber.open(uploaded_file) as pdf:
-            return "".join(page.extract_text() for page in pdf.pages if page.extract_text())
+        # Sessions run on separate threads, so concurrent uploads must not touch PDFium at once
+        with _pdfium_lock():
+            pdf = pdfium.PdfDocument(file_bytes)
+            try:
+                # Lazy, so pages past the size cap are never parsed, however long the PDF is
+                page_texts = (page.get_textpage().get_text_range() for page in pdf)
+                parts, total = [], 0
+                for text in page_texts:
+                    if not text: continue
+                    parts.append(text)
+                    total += len(text)
+                    if total >= max_chars: break
+                return "\n".join(parts)[:max_chars]
+            finally:
+                pdf.close()
     except Exception:
         st.error("Error processing PDF file. It might be corrupted or image-based.")
         return None
 
-def get_gemini_response(model, prompt_text):
-    """Sends a prompt to the Gemini model."""
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=256)
+def _generate_cached(prompt_text, model_name, response_schema=None):
+    """Generates a response for a one-shot prompt, cached by (prompt, model name, schema)."""
+    generation_config = None
+    if response_schema is not None:
+        generation_config = genai.GenerationConfig(
+            response_mime_type="application/json", response_schema=response_schema)
+    # Errors propagate so that failed calls are not cached
+    return genai.GenerativeModel(model_name).generate_content(
+        prompt_text, generation_config=generation_config).text
+
+def get_gemini_response(model, prompt_text, response_schema=None):
+    """Sends a prompt to the Gemini model (as JSON if a response_schema is given); identical prompts are cached."""
     try:
-        return model.generate_content(prompt_text).text
+        return _generate_cached(prompt_text, model.model_name, response_schema)
     except Exception as e:
         return f"Could not get response from AI. Error: {e}"
 
+def get_canned_reply(question):
+    """Returns a fixed reply for greetings and requests for an opinion, or None for real questions."""
+    if GREETING_RE.match(question):
+        return GREETING_REPLY
+    if OPINION_RE.search(question):
+        return OPINION_REPLY
+    return None
+
+def start_document_chat(model, history=()):
+    """Starts a chat session primed once with the Q&A instructions, followed by any prior history."""
+    return model.start_chat(history=[
+        {"role": "user", "parts": [QA_INSTRUCTIONS]},
+        {"role": "model", "parts": ["Ready."]},
+        *history,
+    ])
+
+def compact_chat_history(model, chat):
+    """Folds older turns into a summary once the history outgrows the window; returns the chat to use."""
+    # Broken turns are already rewound in stream_chat_response, so reading the history is safe here
+    history = chat.history[2:]  # Skip the instruction priming
+    if len(history) <= 2 * CHAT_MAX_TURNS:
+        return chat
+    older, recent = history[:-2 * CHAT_KEEP_TURNS], history[-2 * CHAT_KEEP_TURNS:]
+    # Stored turns are bare questions and answers (excerpts are never kept), so the transcript stays small
+    transcript = "\n\n".join(
+        f"{content.role}: {''.join(part.text for part in content.parts)}" for content in older)
+    try:
+        with st.spinner("Condensing earlier conversation..."):
+            summary = model.generate_content(CHAT_SUMMARY_TEMPLATE.format(transcript=transcript)).text
+    except Exception:
+        return chat  # Keep the full history and retry on the next turn
+    return start_document_chat(model, [
+        {"role": "user", "parts": [f"[Prior context summary]: {summary}"]},
+        {"role": "model", "parts": ["Noted."]},
+        *recent,
+    ])
+
+def stream_chat_response(chat, message, question):
+    """Sends a message (excerpts + question) on the chat session and streams the reply chunk by chunk."""
+    try:
+        response = chat.send_message(message, stream=True)
+    except Exception as e:
+        yield f"Could not get response from AI. Error: {e}"
+        return
+    try:
+        for chunk in response:
+            yield chunk.text
+        history = chat.history  # Raises BrokenResponseError if the reply was blocked or cut off
+    except Exception as e:
+        chat.rewind()  # Drop the broken turn, otherwise every later send_message raises
+        yield f"Could not get response from AI. Error: {e}"
+        return
+    # Excerpts are for the current turn only; history keeps the bare question so requests stay O(k·chunk)
+    chat.history = [*history[:-2], {"role": "user", "parts": [question]}, history[-1]]
+
+def split_into_chunks(text, chunk_size=CHUNK_SIZE_CHARS):
+    """Splits document text into fixed-size character windows."""
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+def embed_chunks(chunks):
+    """Embeds document chunks once, returning a row-normalized matrix (or None on failure)."""
+    try:
+        vectors = []
+        for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=chunks[i:i + EMBEDDING_BATCH_SIZE],
+                task_type="retrieval_document",
+            )
+            vectors.extend(result["embedding"])
+        matrix = np.asarray(vectors, dtype=np.float32)
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    except Exception as e:
+        st.warning(f"Could not index the document for chat; answers will use its opening pages. Details: {e}")
+        return None
+
+def retrieve_relevant_chunks(question, chunks, embeddings, k=TOP_K_CHUNKS):
+    """Returns the k chunks most similar to the question, in document order."""
+    if embeddings is None:
+        return chunks[:k]
+    try:
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=question, task_type="retrieval_query")
+    except Exception:
+        return chunks[:k]
+    query = np.asarray(result["embedding"], dtype=np.float32)
+    scores = embeddings @ (query / np.linalg.norm(query))
+    top = np.argsort(scores)[::-1][:k]
+    return [chunks[i] for i in sorted(top)]
+
+def parse_analysis(response_text):
+    """Parses the JSON analysis response into (summary, risks, dashboard)."""
+    try:
+        analysis = json.loads(response_text)
+        # A null or non-string section fails here too (AttributeError), not later while rendering
+        summary, risks = analysis.pop("summary").strip(), analysis.pop("risks").strip()
+    except (ValueError, KeyError, AttributeError, TypeError):
+        # Not the expected JSON (e.g. an error message), so show the raw response as the summary
+        return response_text, "", {}
+    return summary, risks, analysis
+
+def run_analysis(model, doc_text):
+    """Runs the document analysis in a single Gemini call and returns (summary, risks, dashboard)."""
+    analysis_prompt = ANALYSIS_TEMPLATE.format(doc=doc_text[:ANALYSIS_MAX_CHARS])
+    return parse_analysis(get_gemini_response(model, analysis_prompt, response_schema=ANALYSIS_SCHEMA))
+
+def analysis_cache_key(file_bytes):
+    """Builds the disk-cache key from the file content and every setting that shapes the stored analysis."""
+    config = json.dumps([MODEL_NAME, ANALYSIS_TEMPLATE, ANALYSIS_SCHEMA, ANALYSIS_MAX_CHARS,
+                         MAX_DOC_CHARS, CHUNK_SIZE_CHARS, EMBEDDING_MODEL], sort_keys=True)
+    config_hash = hashlib.sha256(config.encode()).hexdigest()[:16]
+    return f"v{ANALYSIS_CACHE_VERSION}:{config_hash}:{hashlib.sha256(file_bytes).hexdigest()}"
+
+@st.cache_resource
+def _analysis_cache_lock():
+    """Returns the process-wide lock guarding the shelve file (shared across sessions)."""
+    return threading.Lock()
+
+def load_cached_analysis(key):
+    """Returns the (summary, risks, dashboard, embeddings) stored on disk for a key, or None."""
+    try:
+        with _analysis_cache_lock(), shelve.open(ANALYSIS_CACHE_PATH) as db:
+            return db.get(key)
+    except Exception:
+        return None  # A missing or unreadable cache must never block an analysis
+
+def store_cached_analysis(key, analysis):
+    """Stores a completed (summary, risks, dashboard, embeddings) on disk."""
+    try:
+        with _analysis_cache_lock(), shelve.open(ANALYSIS_CACHE_PATH) as db:
+            db[key] = analysis
+    except Exception:
+        pass
+
+def dashboard_to_markdown(dashboard):
+    """Formats the structured dashboard as Markdown for the downloadable report."""
+    if not dashboard:
+        return "_The key information dashboard could not be generated._"
+    # Blank lines before each label, otherwise CommonMark folds it into the previous bullet or paragraph
+    lines = ["### 📊 Key Information Dashboard", "", "**Parties:**", ""]
+    lines += [f"- {party}" for party in dashboard.get("parties") or []]
+    lines += ["", "**Key Dates:**", ""]
+    # Entries missing a field or of the wrong shape are shown blank or skipped rather than failing the report
+    lines += [f"- {item.get('date', '')}: {item.get('description', '')}"
+              for item in dashboard.get("key_dates") or [] if isinstance(item, dict)]
+    lines += ["", "**Financial Amounts:**", ""]
+    lines += [f"- {item.get('amount', '')}: {item.get('description', '')}"
+              for item in dashboard.get("financial_amounts") or [] if isinstance(item, dict)]
+    lines += ["", "### 📋 Recommended Action Items", ""]
+    lines += [f"- [ ] {action}" for action in dashboard.get("action_items") or []]
+    return "\n".join(lines)
+
+def render_dashboard(dashboard):
+    """Renders the structured dashboard with metrics, tables, and a checklist."""
+    if not dashboard:
+        st.warning("The key information dashboard could not be generated.")
+        return
+    parties = dashboard.get("parties") or []
+    key_dates = [item for item in dashboard.get("key_dates") or [] if isinstance(item, dict)]
+    amounts = [item for item in dashboard.get("financial_amounts") or [] if isinstance(item, dict)]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Parties", len(parties))
+    col2.metric("Key Dates", len(key_dates))
+    col3.metric("Financial Amounts", len(amounts))
+
+    st.markdown("#### 📊 Key Information Dashboard")
+    st.markdown("**Parties:** " + (", ".join(map(str, parties)) or "None found"))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Key Dates**")
+        st.dataframe(key_dates, hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown("**Financial Amounts**")
+        st.dataframe(amounts, hide_index=True, use_container_width=True)
+
+    st.markdown("#### 📋 Recommended Action Items")
+    st.markdown("\n".join(f"- [ ] {action}" for action in dashboard.get("action_items") or []))
+
+def build_report(summary, risks, dashboard):
+    """Builds the downloadable Markdown report from the analysis sections."""
+    # Blank lines around each rule, otherwise a preceding paragraph turns into a setext heading
+    return "\n".join([
+        "# Legal Eagle AI Analysis Report",
+        "",
+        "## Executive Overview", "", dashboard_to_markdown(dashboard), "", "---", "",
+        "## Simple Summary", "", summary, "", "---", "",
+        "## Risk & Clause Breakdown", "", risks,
+    ])
+
+# --- Chatbot Interface ---
+
+@st.fragment
+def render_chat(model):
+    """Renders the document chat. Chat input reruns only this fragment, not the whole page."""
+    state = st.session_state  # Bind the session-state proxy once
+    st.subheader("💬 Chat with Your Document")
+    for msg in state.messages:
+        st.chat_message(msg["role"]).write(msg["content"])
+
+    if prompt := st.chat_input("Ask a factual question (e.g., 'What is the late fee?')"):
+        state.messages.append({"role": "user", "content": prompt})
+        st.chat_message("user").write(prompt)
+
+        if response := get_canned_reply(prompt):
+            st.chat_message("assistant").write(response)
+            state.messages.append({"role": "assistant", "content": response})
+            return
+
+        excerpts = "\n...\n".join(retrieve_relevant_chunks(prompt, state.chunks, state.embeddings))
+        # Only the excerpts and question are sent; the session carries the instructions and history
+        qa_message = QA_MESSAGE_TEMPLATE.format(excerpts=excerpts, question=prompt)
+        # Render tokens as they arrive; write_stream also returns the full text
+        response = st.chat_message("assistant").write_stream(
+            stream_chat_response(state.chat, qa_message, prompt))
+        state.messages.append({"role": "assistant", "content": response})
+        # Bound what each turn sends; the on-screen transcript keeps every message
+        state.chat = compact_chat_history(model, state.chat)
+
 # --- Main Application Logic ---
 
 def main():
@@ -66,10 +422,14 @@ def main():
     # Initialize session state
     if "analysis_done" not in st.session_state: st.session_state.analysis_done = False
     if "messages" not in st.session_state: st.session_state.messages = []
+    if "chat" not in st.session_state: st.session_state.chat = None
     if "doc_text" not in st.session_state: st.session_state.doc_text = None
+    if "chunks" not in st.session_state: st.session_state.chunks = []
+    if "embeddings" not in st.session_state: st.session_state.embeddings = None
     if "summary" not in st.session_state: st.session_state.summary = ""
     if "risks" not in st.session_state: st.session_state.risks = ""
-    if "dashboard" not in st.session_state: st.session_state.dashboard = ""
+    if "dashboard" not in st.session_state: st.session_state.dashboard = {}
+    if "report" not in st.session_state: st.session_state.report = ""
 
 
     # --- Sidebar for File Upload ---
@@ -79,39 +439,34 @@ def main():
         
         if st.button("Analyze Document", use_container_width=True, type="primary"):
             if uploaded_file:
+                file_bytes = uploaded_file.getvalue()
                 with st.spinner("Processing PDF..."):
-                    st.session_state.doc_text = extract_text_from_pdf(uploaded_file)
+                    doc_text = st.session_state.doc_text = extract_text_from_pdf(file_bytes)
                 
-                if st.session_state.doc_text:
+                if doc_text:
                     with st.spinner("The Eagle is analyzing... This may take a moment."):
-                        # --- Multi-Prompt AI Analysis ---
-                        
-                        # Prompt 1: Summary
-                        summary_prompt = textwrap.dedent(f"Summarize this document's purpose, parties, and key obligations in plain English:\n---\n{st.session_state.doc_text}")
-                        
-                        # Prompt 2: Risk Analysis with Indicators
-                        risks_prompt = textwrap.dedent(f"""
-                            Analyze this document for risks and key clauses. Categorize them using these exact markdown headers and emojis:
-                            - **⚠️ High-Priority Risks:** (e.g., penalties, liabilities, auto-renewals)
-                            - **📝 Key Responsibilities:** (e.g., payment duties, notice periods, confidentiality)
-                            - **✅ Standard Provisions:** (e.g., governing law, severability)
-                            Document:\n---\n{st.session_state.doc_text}
-                        """)
-
-                        # Prompt 3: Executive Dashboard & Action Items (THE "WOW" FACTOR)
-                        dashboard_prompt = textwrap.dedent(f"""
-                            From this document, extract key entities and generate a user checklist. Use these exact markdown headers:
-                            - **📊 Key Information Dashboard:** (List Parties, Key Dates, Financial Amounts)
-                            - **📋 Recommended Action Items:** (Create a checklist of next steps for the user)
-                            Document:\n---\n{st.session_state.doc_text}
-                        """)
-
-                        st.session_state.summary = get_gemini_response(model, summary_prompt)
-                        st.session_state.risks = get_gemini_response(model, risks_prompt)
-                        st.session_state.dashboard = get_gemini_response(model, dashboard_prompt)
+                        cache_key = analysis_cache_key(file_bytes)
+                        # Chunking is local and deterministic; only the embeddings need caching
+                        chunks = st.session_state.chunks = split_into_chunks(doc_text)
+                        cached = load_cached_analysis(cache_key)
+                        # Embeddings must line up row-for-row with the chunks, otherwise retrieval indexes past them
+                        if cached is None or len(cached[-1]) != len(chunks):
+                            analysis = run_analysis(model, doc_text)
+                            # Index the full document so each chat turn only sends relevant chunks
+                            embeddings = embed_chunks(chunks)
+                            # A failed call leaves sections empty or embeddings None; only persist complete results
+                            if all(analysis) and embeddings is not None:
+                                store_cached_analysis(cache_key, (*analysis, embeddings))
+                        else:
+                            *analysis, embeddings = cached
+                        st.session_state.summary, st.session_state.risks, st.session_state.dashboard = analysis
+                        st.session_state.embeddings = embeddings
+                        # Built once per analysis rather than on every rerun
+                        st.session_state.report = build_report(*analysis)
                         
                         st.session_state.analysis_done = True
                         st.session_state.messages = []
+                        st.session_state.chat = start_document_chat(model)
                     st.success("Analysis Complete!")
             else:
                 st.warning("Please upload a document first.")
@@ -122,7 +477,7 @@ def main():
     else:
         # --- The Executive Dashboard ---
         st.subheader("Executive Overview")
-        st.markdown(st.session_state.dashboard)
+        render_dashboard(st.session_state.dashboard)
         st.divider()
 
         # --- Detailed Analysis Columns ---
@@ -136,21 +491,9 @@ def main():
             st.markdown(st.session_state.risks)
         
         # --- Download Report Button ---
-        full_report = f"""
-# Legal Eagle AI Analysis Report
-
-## Executive Overview
-{st.session_state.dashboard}
----
-## Simple Summary
-{st.session_state.summary}
----
-## Risk & Clause Breakdown
-{st.session_state.risks}
-        """
         st.download_button(
             label="📥 Download Full Report",
-            data=full_report,
+            data=st.session_state.report,
             file_name="Legal_Eagle_AI_Report.md",
             mime="text/markdown",
             use_container_width=True
@@ -158,28 +501,7 @@ def main():
 
         st.divider()
 
-        # --- Chatbot Interface ---
-        st.subheader("💬 Chat with Your Document")
-        for msg in st.session_state.messages:
-            st.chat_message(msg["role"]).write(msg["content"])
-
-        if prompt := st.chat_input("Ask a factual question (e.g., 'What is the late fee?')"):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
-            
-            with st.spinner("Thinking..."):
-                # The final, smartest Q&A prompt
-                qa_prompt = textwrap.dedent(f"""
-                    **Role:** AI Assistant answering questions about a legal document.
-                    **Instructions Hierarchy:**
-                    1. **Handle Greetings:** If the user says "hi" or "hello", give a friendly greeting.
-                    2. **Handle Opinions:** If the user asks if the doc is "safe" or "fair", state you cannot give legal advice and direct them to the risk analysis.
-                    3. **Handle Factual Questions:** Answer questions using *only* the document text provided. Cite your source with a quote. If the answer isn't in the text, say so.
-                    **Document Text:**\n---\n{st.session_state.doc_text}\n---\n**User's Question:** "{prompt}"\n**Answer:**
-                """)
-                response = get_gemini_response(model, qa_prompt)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.chat_message("assistant").write(response)
+        render_chat(model)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file